@@ -26,6 +26,8 @@ pymysql.install_as_MySQLdb()
 def create_app():
     app = Flask(__name__)
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or secrets.token_hex(16)
+    # Server-side pepper for PIN hashes; without it PINs fall back to a salted password hash
+    app.config['PIN_PEPPER'] = os.environ.get('PIN_PEPPER')
 
     # CSRF Protection
     csrf.init_app(app)
@@ -83,11 +85,18 @@ from models import User, Transaction
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Roles and status are deliberately read from the database on every request
+    # (not cached in the session) so that demotions and deactivations take
+    # effect immediately. Session.get() checks the identity map before querying.
+    return db.session.get(User, int(user_id))
 
 # Import routes after app creation
 from routes import *
 
+# Warm region/province data so admin address forms don't wait on the PSGC API
+import psgc_api
+psgc_api.start_preload()
+
 def secure_login_user(user, **kwargs):
     """Log in user and regenerate session to prevent fixation."""
     from flask import session
@@ -77,6 +77,8 @@ def init_mysql_database():
                   postal_code VARCHAR(10),
                   phone VARCHAR(20),
                   password_hash VARCHAR(128) NOT NULL,
+                  pin_hash VARCHAR(128),
+                  pin_failed_attempts INT NOT NULL DEFAULT 0,
                   account_number VARCHAR(10) NOT NULL UNIQUE,
                   balance FLOAT DEFAULT 1000.0,
                   status VARCHAR(20) DEFAULT 'pending',
@@ -85,7 +87,8 @@ def init_mysql_database():
                   date_registered DATETIME DEFAULT CURRENT_TIMESTAMP,
                   INDEX idx_username (username),
                   INDEX idx_email (email),
-                  INDEX idx_account_number (account_number)
+                  INDEX idx_account_number (account_number),
+                  INDEX idx_admin_mgr_status (is_admin, is_manager, status)
                 ) ENGINE=InnoDB
                 """)
                 
@@ -102,9 +105,10 @@ def init_mysql_database():
                   details TEXT,
                   FOREIGN KEY (sender_id) REFERENCES user (id),
                   FOREIGN KEY (receiver_id) REFERENCES user (id),
-                  INDEX idx_sender (sender_id),
-                  INDEX idx_receiver (receiver_id),
-                  INDEX idx_timestamp (timestamp)
+                  INDEX idx_timestamp (timestamp),
+                  INDEX idx_sender_timestamp (sender_id, timestamp),
+                  INDEX idx_receiver_timestamp (receiver_id, timestamp),
+                  INDEX idx_type_timestamp (transaction_type, timestamp)
                 ) ENGINE=InnoDB
                 """)
                 
@@ -128,6 +132,59 @@ def init_mysql_database():
     
     return True  # Return True on success
 
+# Columns added after the initial schema, as (table, column, definition).
+# upgrade_mysql_database() adds any that an existing database is missing.
+SCHEMA_UPGRADES = [
+    ('user', 'pin_failed_attempts', 'INT NOT NULL DEFAULT 0'),
+]
+
+def upgrade_mysql_database():
+    """Add missing columns to an existing database without dropping any data."""
+    mysql_port = os.getenv("MYSQL_PORT")
+    mysql_port = int(mysql_port) if mysql_port is not None else 3306
+    mysql_database = os.environ.get('MYSQL_DATABASE')
+    
+    try:
+        print("Attempting to connect to MySQL server...")
+        connection = pymysql.connect(
+            host=os.environ.get('MYSQL_HOST'),
+            port=mysql_port,
+            user=os.environ.get('MYSQL_USER'),
+            password=os.environ.get('MYSQL_PASSWORD'),
+            database=mysql_database,
+            charset='utf8mb4',
+            cursorclass=pymysql.cursors.DictCursor,
+            connect_timeout=10  # Add timeout to prevent hanging
+        )
+    except Exception as e:
+        print(f"Error connecting to MySQL: {e}")
+        print(traceback.format_exc())
+        return False
+    
+    try:
+        with connection.cursor() as cursor:
+            for table, column, definition in SCHEMA_UPGRADES:
+                cursor.execute(
+                    "SELECT COUNT(*) AS n FROM information_schema.COLUMNS "
+                    "WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+                    (mysql_database, table, column)
+                )
+                if cursor.fetchone()['n']:
+                    print(f"Column {table}.{column} already exists")
+                    continue
+                print(f"Adding column {table}.{column}...")
+                cursor.execute(f"ALTER TABLE `{table}` ADD COLUMN `{column}` {definition}")
+        connection.commit()
+    except Exception as sql_error:
+        print(f"Error during SQL execution: {sql_error}")
+        print(traceback.format_exc())
+        return False
+    finally:
+        connection.close()
+        print("MySQL connection closed.")
+    
+    return True
+
 def init_flask_app_db():
     """Initialize the Flask application's database tables using SQLAlchemy."""
     try:
@@ -379,6 +436,16 @@ def init_flask_app_db():
         return False
 
 if __name__ == "__main__":
+    import sys
+    if '--upgrade' in sys.argv[1:]:
+        print("== Simple Banking App Database Upgrade ==")
+        if upgrade_mysql_database():
+            print("\n=== Database upgrade complete! ===")
+        else:
+            print("\n=== ERROR: Database upgrade failed! ===")
+            sys.exit(1)
+        sys.exit(0)
+    
     print("== Simple Banking App Database Initialization ==")
     print("\nStep 1: Initializing MySQL database schema directly...")
     mysql_success = init_mysql_database()
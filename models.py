@@ -1,18 +1,33 @@
 from extensions import db, bcrypt
+from flask import current_app
 from flask_login import UserMixin
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import selectinload
 from werkzeug.security import generate_password_hash, check_password_hash
 import datetime
+import hashlib
+import hmac
 import random
 import string
 
+# Prefix marking PIN hashes created with the keyed HMAC-SHA256 scheme
+PIN_HMAC_PREFIX = 'hmac-sha256$'
+
+# Wrong PIN entries allowed before PIN verification is locked until a reset
+PIN_MAX_ATTEMPTS = 3
+
 def generate_account_number():
     """Generate a random 10-digit account number"""
     return ''.join(random.choices(string.digits, k=10))
 
 class User(UserMixin, db.Model):
+    __table_args__ = (
+        db.Index('idx_admin_mgr_status', 'is_admin', 'is_manager', 'status'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(64), unique=True, index=True)
-    email = db.Column(db.String(120), unique=True, index=True)
+    username = db.Column(db.String(64), unique=True, index=True, nullable=False)
+    email = db.Column(db.String(120), unique=True, index=True, nullable=False)
     firstname = db.Column(db.String(64), nullable=True)
     lastname = db.Column(db.String(64), nullable=True)
     # Detailed address fields
@@ -29,7 +44,8 @@ class User(UserMixin, db.Model):
     phone = db.Column(db.String(20), nullable=True)
     password_hash = db.Column(db.String(128))
     pin_hash = db.Column(db.String(128), nullable=True)
-    account_number = db.Column(db.String(10), unique=True, default=generate_account_number)
+    pin_failed_attempts = db.Column(db.Integer, default=0, nullable=False)  # Consecutive wrong PIN entries
+    account_number = db.Column(db.String(10), unique=True, index=True, nullable=False, default=generate_account_number)
     balance = db.Column(db.Float, default=1000.0)  # Match schema.sql default of 1000.0
     status = db.Column(db.String(20), default='pending')  # 'active', 'deactivated', or 'pending'
     is_admin = db.Column(db.Boolean, default=False)  # Admin status
@@ -59,6 +75,24 @@ class User(UserMixin, db.Model):
             return ", ".join(address_parts)
         return "No address provided"
     
+    @hybrid_property
+    def role(self):
+        """Display name of the user's role: 'Admin', 'Manager' or 'User'"""
+        if self.is_admin:
+            return 'Admin'
+        if self.is_manager:
+            return 'Manager'
+        return 'User'
+    
+    @role.expression
+    def role(cls):
+        # Same rule evaluated in SQL, so queries can select it as a column
+        return db.case(
+            (cls.is_admin.is_(True), 'Admin'),
+            (cls.is_manager.is_(True), 'Manager'),
+            else_='User'
+        )
+    
     def __repr__(self):
         return f'<User {self.username}>'
     
@@ -70,11 +104,52 @@ class User(UserMixin, db.Model):
         # Use bcrypt to verify password
         return bcrypt.check_password_hash(self.password_hash, password)
     
+    @staticmethod
+    def _pin_digest(pin, pepper):
+        return PIN_HMAC_PREFIX + hmac.new(pepper.encode('utf-8'), pin.encode('utf-8'), hashlib.sha256).hexdigest()
+    
     def set_pin(self, pin):
-        self.pin_hash = generate_password_hash(pin)
+        # PIN guesses are rate limited and verification locks after
+        # PIN_MAX_ATTEMPTS failures, so when a server-side pepper is configured
+        # use a keyed HMAC instead of a slow password hash
+        pepper = current_app.config.get('PIN_PEPPER')
+        if pepper:
+            self.pin_hash = self._pin_digest(pin, pepper)
+        else:
+            self.pin_hash = generate_password_hash(pin)
+        self.pin_failed_attempts = 0
+    
+    @property
+    def pin_locked(self):
+        """True once too many wrong PINs were entered; cleared by set_pin"""
+        return (self.pin_failed_attempts or 0) >= PIN_MAX_ATTEMPTS
     
     def check_pin(self, pin):
-        return self.pin_hash and check_password_hash(self.pin_hash, pin)
+        # Failures are counted on the user, and a locked PIN is refused without
+        # being checked. The caller commits the session either way.
+        if not self.pin_hash or self.pin_locked:
+            return False
+        if self.pin_hash.startswith(PIN_HMAC_PREFIX) and not current_app.config.get('PIN_PEPPER'):
+            # A server misconfiguration, not a wrong guess, so don't count it
+            current_app.logger.error('PIN_PEPPER is not set but user %s has a peppered PIN hash; PINs cannot be verified', self.id)
+            return False
+        if self._verify_pin(pin):
+            self.pin_failed_attempts = 0
+            return True
+        # Increment in SQL so concurrent guesses can't overwrite each other
+        self.pin_failed_attempts = User.pin_failed_attempts + 1
+        return False
+    
+    def _verify_pin(self, pin):
+        pepper = current_app.config.get('PIN_PEPPER')
+        if self.pin_hash.startswith(PIN_HMAC_PREFIX):
+            return bool(pepper) and hmac.compare_digest(self.pin_hash, self._pin_digest(pin, pepper))
+        if not check_password_hash(self.pin_hash, pin):
+            return False
+        # Upgrade older PIN hashes; the caller commits the session
+        if pepper:
+            self.set_pin(pin)
+        return True
     
     @property
     def is_active(self):
@@ -120,10 +195,15 @@ class User(UserMixin, db.Model):
         return True
     
     def get_recent_transactions(self, limit=10):
-        sent = self.transactions_sent.filter(Transaction.transaction_type != 'user_edit').order_by(Transaction.timestamp.desc()).limit(limit).all()
-        received = self.transactions_received.filter(Transaction.transaction_type != 'user_edit').order_by(Transaction.timestamp.desc()).limit(limit).all()
-        all_transactions = sorted(sent + received, key=lambda x: x.timestamp, reverse=True)
-        return all_transactions[:limit]
+        # Single query for both directions, loading the counterparties up front
+        # so the template doesn't issue a query per transaction
+        return Transaction.query.options(
+            selectinload(Transaction.sender),
+            selectinload(Transaction.receiver)
+        ).filter(
+            (Transaction.sender_id == self.id) | (Transaction.receiver_id == self.id),
+            Transaction.transaction_type != 'user_edit'
+        ).order_by(Transaction.timestamp.desc()).limit(limit).all()
     
     def activate_account(self):
         """Activate a user account"""
@@ -153,6 +233,12 @@ class User(UserMixin, db.Model):
         return False
 
 class Transaction(db.Model):
+    __table_args__ = (
+        db.Index('idx_sender_timestamp', 'sender_id', 'timestamp'),
+        db.Index('idx_receiver_timestamp', 'receiver_id', 'timestamp'),
+        db.Index('idx_type_timestamp', 'transaction_type', 'timestamp'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     receiver_id = db.Column(db.Integer, db.ForeignKey('user.id'))
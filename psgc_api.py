@@ -1,122 +1,280 @@
 import requests
 import json
-from functools import lru_cache
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 # Base URL for the API
 BASE_URL = "https://psgc.gitlab.io/api"
 
-@lru_cache(maxsize=32)
+# On-disk copy of the preloaded region/province data, reused across restarts
+CACHE_FILE = os.environ.get('PSGC_CACHE_FILE') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'psgc_cache.json')
+
+# Seconds to wait for the API to connect or respond before giving up
+REQUEST_TIMEOUT = 10
+
+# Shared pool for issuing independent API requests concurrently
+_executor = ThreadPoolExecutor(max_workers=8)
+
+# How long results stored with cached() stay fresh, in seconds, and how many
+# entries are kept before the least recently used ones are dropped
+CACHE_TTL = 3600
+CACHE_MAXSIZE = 4096
+
+# Entries stored by cached(): key -> (expires_at, value), in LRU order. A key
+# only has a lock while it is being loaded.
+_ttl_cache = OrderedDict()
+_load_locks = {}
+_cache_guard = threading.Lock()
+_MISSING = object()
+
+# Region/province data filled in by preload() or warm_cache()
+_REGIONS = []
+_PROVINCES = []
+_PROVINCES_BY_REGION = {}
+
+def _install(regions, provinces):
+    global _REGIONS, _PROVINCES, _PROVINCES_BY_REGION
+    by_region = {}
+    for province in provinces:
+        by_region.setdefault(province.get('regionCode'), []).append(province)
+    # Swap in complete objects so concurrent readers never see partial data
+    _PROVINCES_BY_REGION = by_region
+    _PROVINCES = provinces
+    _REGIONS = regions
+
+def preload():
+    """Load regions and provinces into memory from the disk cache, if present"""
+    try:
+        with open(CACHE_FILE, encoding='utf-8') as f:
+            regions, provinces = json.load(f)
+    except (OSError, ValueError):
+        return False
+    _install(regions, provinces)
+    return True
+
+def warm_cache():
+    """Fetch regions and provinces from the API into memory and the disk cache"""
+    try:
+        regions, provinces = get_regions.strict(), get_provinces.strict()
+    except requests.RequestException:
+        return False
+    if not regions or not provinces:
+        return False
+    _install(regions, provinces)
+    try:
+        with open(CACHE_FILE, 'w', encoding='utf-8') as f:
+            json.dump([regions, provinces], f)
+    except OSError:
+        pass  # Keep the in-memory copy even if the cache can't be written
+    return True
+
+def start_preload():
+    """Load the disk cache, or warm it from the API in a background thread.
+    
+    Never blocks on the network, so importing the app stays fast even when
+    the PSGC API is slow or unreachable.
+    """
+    if not preload():
+        threading.Thread(target=warm_cache, name='psgc-preload', daemon=True).start()
+
+def _get_json(path):
+    """Fetch an API path, raising requests.RequestException unless it returns 200"""
+    response = requests.get(f"{BASE_URL}/{path}", timeout=REQUEST_TIMEOUT)
+    if response.status_code != 200:
+        raise requests.HTTPError(f"PSGC API returned {response.status_code} for /{path}", response=response)
+    return response.json()
+
+def _memoize(default):
+    """Cache a lookup with cached(); on an API error return default, uncached.
+    
+    Successful results are kept even when empty. The decorated function's
+    strict() variant raises the API error instead of returning default.
+    """
+    def decorator(func):
+        def strict(*args, **kwargs):
+            key = (func.__name__, args, tuple(sorted(kwargs.items())))
+            return cached(key, lambda: func(*args, **kwargs))
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return strict(*args, **kwargs)
+            except requests.RequestException:
+                return default
+        wrapper.strict = strict
+        return wrapper
+    return decorator
+
+@_memoize([])
 def get_regions():
     """Get all regions from the PSGC API"""
-    url = f"{BASE_URL}/regions"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        # Sort by name
-        data.sort(key=lambda x: x['name'])
-        return data
-    return []
-
-@lru_cache(maxsize=32)
+    if _REGIONS:
+        return _REGIONS
+    data = _get_json('regions')
+    # Sort by name
+    data.sort(key=lambda x: x['name'])
+    return data
+
+@_memoize([])
 def get_provinces(region_code=None):
     """Get provinces from the PSGC API, optionally filtered by region code"""
-    url = f"{BASE_URL}/provinces"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        # Filter by region if provided
-        if region_code:
-            data = [p for p in data if p.get('regionCode') == region_code]
-        # Sort by name
-        data.sort(key=lambda x: x['name'])
-        return data
-    return []
-
-@lru_cache(maxsize=32)
+    if _PROVINCES:
+        return _PROVINCES_BY_REGION.get(region_code, []) if region_code else _PROVINCES
+    data = _get_json('provinces')
+    # Filter by region if provided
+    if region_code:
+        data = [p for p in data if p.get('regionCode') == region_code]
+    # Sort by name
+    data.sort(key=lambda x: x['name'])
+    return data
+
+@_memoize([])
 def get_cities(province_code=None):
     """Get cities from the PSGC API, optionally filtered by province code"""
-    url = f"{BASE_URL}/cities"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        # Filter by province if provided
-        if province_code:
-            data = [c for c in data if c.get('provinceCode') == province_code]
-        # Sort by name
-        data.sort(key=lambda x: x['name'])
-        return data
-    return []
-
-@lru_cache(maxsize=32)
+    data = _get_json('cities')
+    # Filter by province if provided
+    if province_code:
+        data = [c for c in data if c.get('provinceCode') == province_code]
+    # Sort by name
+    data.sort(key=lambda x: x['name'])
+    return data
+
+@_memoize([])
 def get_municipalities(province_code=None):
     """Get municipalities from the PSGC API, optionally filtered by province code"""
-    url = f"{BASE_URL}/municipalities"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        # Filter by province if provided
-        if province_code:
-            data = [m for m in data if m.get('provinceCode') == province_code]
-        # Sort by name
-        data.sort(key=lambda x: x['name'])
-        return data
-    return []
-
-@lru_cache(maxsize=32)
+    data = _get_json('municipalities')
+    # Filter by province if provided
+    if province_code:
+        data = [m for m in data if m.get('provinceCode') == province_code]
+    # Sort by name
+    data.sort(key=lambda x: x['name'])
+    return data
+
+@_memoize([])
 def get_barangays(city_code=None, municipality_code=None):
     """Get barangays from the PSGC API, filtered by city or municipality code"""
-    url = f"{BASE_URL}/barangays"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        # Filter by city or municipality
-        if city_code:
-            data = [b for b in data if b.get('cityCode') == city_code]
-        elif municipality_code:
-            data = [b for b in data if b.get('municipalityCode') == municipality_code]
-        else:
-            return []  # Too many to return without a filter
-        # Sort by name
-        data.sort(key=lambda x: x['name'])
-        return data
-    return []
+    data = _get_json('barangays')
+    # Filter by city or municipality
+    if city_code:
+        data = [b for b in data if b.get('cityCode') == city_code]
+    elif municipality_code:
+        data = [b for b in data if b.get('municipalityCode') == municipality_code]
+    else:
+        return []  # Too many to return without a filter
+    # Sort by name
+    data.sort(key=lambda x: x['name'])
+    return data
 
+@_memoize(None)
 def get_region_by_code(code):
     """Get a specific region by code"""
-    regions = get_regions()
+    regions = get_regions.strict()
     for region in regions:
         if region['code'] == code:
             return region
     return None
 
+@_memoize(None)
 def get_province_by_code(code):
     """Get a specific province by code"""
-    provinces = get_provinces()
+    provinces = get_provinces.strict()
     for province in provinces:
         if province['code'] == code:
             return province
     return None
 
+@_memoize(None)
 def get_city_by_code(code):
     """Get a specific city by code"""
-    cities = get_cities()
+    cities = get_cities.strict()
     for city in cities:
         if city['code'] == code:
             return city
     return None
 
+@_memoize(None)
 def get_municipality_by_code(code):
     """Get a specific municipality by code"""
-    municipalities = get_municipalities()
+    municipalities = get_municipalities.strict()
     for municipality in municipalities:
         if municipality['code'] == code:
             return municipality
     return None
 
+@_memoize(None)
 def get_barangay_by_code(code):
     """Get a specific barangay by code (requires full search)"""
-    url = f"{BASE_URL}/barangays/{code}"
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json()
-    return None 
\ No newline at end of file
+    return _get_json(f'barangays/{code}')
+
+def get_cities_and_municipalities(province_code=None):
+    """Get cities and municipalities for a province, fetching both concurrently"""
+    cities = _executor.submit(get_cities, province_code)
+    municipalities = _executor.submit(get_municipalities, province_code)
+    return cities.result(), municipalities.result()
+
+def get_city_or_municipality_by_code(code):
+    """Resolve a code to (city, municipality); at most one of them is set"""
+    city = _executor.submit(get_city_by_code, code)
+    municipality = _executor.submit(get_municipality_by_code, code)
+    city = city.result()
+    if city:
+        return city, None
+    return None, municipality.result()
+
+@_memoize([])
+def get_barangays_for_locality(code):
+    """Get barangays for a city or municipality code.
+    
+    City and municipality codes don't overlap, so one /barangays fetch
+    filtered on either field covers both without first resolving the code.
+    """
+    data = [b for b in _get_json('barangays') if code in (b.get('cityCode'), b.get('municipalityCode'))]
+    # Sort by name
+    data.sort(key=lambda x: x['name'])
+    return data
+
+def _cache_get(key):
+    with _cache_guard:
+        entry = _ttl_cache.get(key)
+        if entry is None:
+            return _MISSING
+        if entry[0] <= time.monotonic():
+            del _ttl_cache[key]
+            return _MISSING
+        _ttl_cache.move_to_end(key)
+        return entry[1]
+
+def _cache_put(key, value, ttl):
+    with _cache_guard:
+        _ttl_cache[key] = (time.monotonic() + ttl, value)
+        _ttl_cache.move_to_end(key)
+        while len(_ttl_cache) > CACHE_MAXSIZE:
+            _ttl_cache.popitem(last=False)
+
+def cached(key, loader, ttl=CACHE_TTL):
+    """Return the cached value for key, calling loader() when missing or stale.
+    
+    Concurrent misses on the same key wait for a single loader() call. Nothing
+    is cached if loader() raises.
+    """
+    value = _cache_get(key)
+    if value is not _MISSING:
+        return value
+    with _cache_guard:
+        lock = _load_locks.setdefault(key, threading.Lock())
+    try:
+        with lock:
+            value = _cache_get(key)
+            if value is not _MISSING:
+                return value
+            value = loader()
+            _cache_put(key, value, ttl)
+            return value
+    finally:
+        with _cache_guard:
+            if _load_locks.get(key) is lock:
+                del _load_locks[key]
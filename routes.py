@@ -1,39 +1,133 @@
-from flask import render_template, redirect, url_for, flash, request, jsonify, session
+from flask import render_template, redirect, url_for, flash, request, jsonify, session, g, Response, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.urls import url_parse
 from app import app  # Only import app here
 from flask_wtf.csrf import CSRFError
 from extensions import db, limiter
-from forms import LoginForm, RegistrationForm, TransferForm, ResetPasswordRequestForm, ResetPasswordForm, DepositForm, UserEditForm, ConfirmTransferForm, PinForm, CreatePinForm
+from forms import LoginForm, RegistrationForm, TransferForm, ResetPasswordRequestForm, ResetPasswordForm, DepositForm, UserEditForm, ConfirmTransferForm, PinForm, CreatePinForm, ResetPinForm
 from models import User, Transaction
-from itsdangerous import URLSafeTimedSerializer, SignatureExpired
+from sqlalchemy.orm import aliased, selectinload
+from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadSignature
 import os
+import csv
+import hashlib
+import hmac
+import itertools
+import math
 from functools import wraps
 import psgc_api
 import datetime
-import re
+import string
+import time
 from flask_limiter.util import get_remote_address
 from flask_limiter.errors import RateLimitExceeded
 import logging
+from io import StringIO
+
+# Password strength character classes, mapped to a bit flag per class
+_SPECIAL = frozenset('!@#$%^&*(),.?":{}|<>')
+_CHAR_CLASS = {}
+_CHAR_CLASS.update(dict.fromkeys(string.ascii_uppercase, 1))
+_CHAR_CLASS.update(dict.fromkeys(string.ascii_lowercase, 2))
+_CHAR_CLASS.update(dict.fromkeys(string.digits, 4))
+_CHAR_CLASS.update(dict.fromkeys(_SPECIAL, 8))
+_ALL_CLASSES = 15
 
 def is_strong_password(password):
     """Check if the password meets the required strength criteria."""
     if len(password) < 8:
         return False
-    if not re.search(r"[A-Z]", password):
-        return False
-    if not re.search(r"[a-z]", password):
-        return False
-    if not re.search(r"[0-9]", password):
-        return False
-    if not re.search(r"[!@#$%^&*(),.?\":{}|<>]", password):
-        return False
-    return True
+    # Single pass over the password, stopping once every class has been seen
+    flags = 0
+    for c in password:
+        flags |= _CHAR_CLASS.get(c, 0)
+        if flags == _ALL_CLASSES:
+            return True
+    return False
+
+# Current year for templates, refreshed at most once an hour
+_current_year = datetime.datetime.now().year
+_year_checked_at = time.monotonic()
 
 # Context processor to provide current year to all templates
 @app.context_processor
 def inject_year():
-    return {'current_year': datetime.datetime.now().year}
+    global _current_year, _year_checked_at
+    if time.monotonic() - _year_checked_at > 3600:
+        _current_year = datetime.datetime.now().year
+        _year_checked_at = time.monotonic()
+    return {'current_year': _current_year}
+
+CSV_BATCH_SIZE = 1000
+
+def stream_csv(header, rows):
+    """Yield CSV text for the header and rows, one batch of rows at a time."""
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    rows = iter(rows)
+    while True:
+        writer.writerows(itertools.islice(rows, CSV_BATCH_SIZE))
+        chunk = buffer.getvalue()
+        if not chunk:
+            return
+        yield chunk
+        buffer.seek(0)
+        buffer.truncate()
+
+def format_peso(value):
+    """Format an amount for CSV exports."""
+    return f"₱{value:.2f}" if value is not None else 'N/A'
+
+TRANSACTIONS_PER_PAGE = 50
+
+def paginate_transactions(query):
+    """Fetch one page of a transaction query using keyset pagination.
+    
+    Rows are ordered newest first on (timestamp, id); the page continues after
+    the before_ts/before_id query args. Returns the transactions plus URLs for
+    the next (older) page and the newest page, or None where not applicable.
+    """
+    before_ts = request.args.get('before_ts')
+    before_id = request.args.get('before_id', type=int)
+    if before_ts and before_id is not None:
+        try:
+            before_ts = datetime.datetime.fromisoformat(before_ts)
+        except ValueError:
+            before_ts = None
+        if before_ts:
+            query = query.filter(db.or_(
+                Transaction.timestamp < before_ts,
+                db.and_(Transaction.timestamp == before_ts, Transaction.id < before_id)
+            ))
+    else:
+        before_ts = None
+    
+    transactions = query.order_by(
+        Transaction.timestamp.desc(), Transaction.id.desc()
+    ).limit(TRANSACTIONS_PER_PAGE + 1).all()
+    
+    args = {k: v for k, v in request.args.items() if k not in ('before_ts', 'before_id')}
+    args.update(request.view_args or {})
+    next_url = None
+    if len(transactions) > TRANSACTIONS_PER_PAGE:
+        transactions = transactions[:TRANSACTIONS_PER_PAGE]
+        last = transactions[-1]
+        next_url = url_for(request.endpoint, before_ts=last.timestamp.isoformat(), before_id=last.id, **args)
+    newest_url = url_for(request.endpoint, **args) if before_ts else None
+    return transactions, next_url, newest_url
+
+def parse_search_number(term):
+    """Parse a search term once as a transaction id and as an amount (None if not numeric)."""
+    # Only plain ASCII decimals: isdigit() alone accepts digits such as '²'
+    # that int() rejects, and float() accepts 'nan', 'inf' and '1_0'
+    if not term.isascii():
+        return None, None
+    as_int = int(term) if term.isdigit() and len(term) <= 18 else None  # Fits a BIGINT
+    as_float = float(term) if term.replace('.', '', 1).isdigit() else None
+    if as_float is not None and not math.isfinite(as_float):
+        as_float = None  # e.g. a digit string too long for a float
+    return as_int, as_float
 
 # Admin required decorator
 def admin_required(f):
@@ -55,12 +149,70 @@ def manager_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# --- Audit records ---
+# Audit rows are queued on the request and written in one batch by
+# commit_with_audits(), in the same transaction as the changes they describe.
+def record_audit(admin_id, user_id, changes, transaction_type='user_edit'):
+    """Queue an audit record of changes made by an admin to a user."""
+    if 'pending_audits' not in g:
+        g.pending_audits = []
+    g.pending_audits.append({
+        'sender_id': admin_id,      # Admin making the change
+        'receiver_id': user_id,     # User being modified
+        'amount': None,             # No money involved
+        'transaction_type': transaction_type,
+        'details': "\n".join(changes),
+        'timestamp': datetime.datetime.utcnow()
+    })
+
+def commit_with_audits():
+    """Write any queued audit records and commit the session."""
+    pending = g.pop('pending_audits', None)
+    if pending:
+        db.session.bulk_insert_mappings(Transaction, pending)
+    db.session.commit()
+
+# --- Admin list cache ---
+# Admin membership rarely changes, so the (id, username) rows used by the
+# audit views are cached per process for a short time. create_admin and
+# toggle_admin clear it; other processes pick up changes within the TTL.
+ADMIN_CACHE_TTL = 60
+_admin_cache = None  # (expires_at, rows)
+
+def get_admins():
+    """Return (id, username) rows for admin users, excluding managers."""
+    global _admin_cache
+    if _admin_cache and _admin_cache[0] > time.monotonic():
+        return _admin_cache[1]
+    rows = db.session.query(User.id, User.username).filter(
+        User.is_admin.is_(True), User.is_manager.is_(False)
+    ).order_by(User.username).all()
+    _admin_cache = (time.monotonic() + ADMIN_CACHE_TTL, rows)
+    return rows
+
+def clear_admin_cache():
+    global _admin_cache
+    _admin_cache = None
+
+# Password reset token serializer, built once per process
+reset_serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'])
+
+def _ensure_active(log_out=False):
+    """Return a redirect if the current user's account isn't active, else None."""
+    user = current_user._get_current_object()
+    if user.status == 'active' or user.is_admin or user.is_manager:
+        return None
+    flash('Your account is awaiting approval from an administrator.')
+    if log_out:
+        logout_user()
+        return redirect(url_for('login'))
+    return redirect(url_for('index'))
+
 # Email functionality (simulated for this example)
 def send_password_reset_email(user):
     # In a real app, this would send an actual email with a reset token
     # For simplicity, we're just creating the token and displaying it
-    serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'])
-    token = serializer.dumps(user.email, salt='password-reset')
+    token = reset_serializer.dumps(user.email, salt='password-reset')
     reset_url = url_for('reset_password', token=token, _external=True)
     flash(f'Password reset link (would be emailed): {reset_url}')
 
@@ -68,10 +220,8 @@ def send_password_reset_email(user):
 @app.route('/index')
 @login_required
 def index():
-    if current_user.status != 'active' and not current_user.is_admin and not current_user.is_manager:
-        flash('Your account is awaiting approval from an administrator.')
-        logout_user()
-        return redirect(url_for('login'))
+    if (response := _ensure_active(log_out=True)):
+        return response
     return render_template('index.html', title='Home')
 
 @app.route('/about')
@@ -89,32 +239,60 @@ def rate_limit_handler(e):
     logging.warning(f"Rate limit exceeded: {request.remote_addr} {request.endpoint}")
     return render_template('rate_limit_error.html', title='Rate Limit Exceeded', message='You have exceeded the allowed number of requests. Please try again later.'), 429
 
+# Rate limit key: the client IP, resolved once per request and shared by
+# every limit applied to the endpoint
+def _client_ip():
+    if 'client_ip' not in g:
+        g.client_ip = get_remote_address()
+    return g.client_ip
+
+# Rate limit key: the logged-in user's id, falling back to the client IP
+def _user_or_ip():
+    if current_user.is_authenticated:
+        return current_user.get_id()
+    return _client_ip()
+
+# Rate limit key: a submitted form field, falling back to the client IP.
+# Only POSTs carry the form, so other methods skip form parsing entirely.
+def _form_field_or_ip(field):
+    def key_func():
+        if request.method == 'POST':
+            return request.form.get(field) or _client_ip()
+        return _client_ip()
+    return key_func
+
 # 3. Apply stricter, combined per-user and per-IP limits to sensitive endpoints
 @app.route('/login', methods=['GET', 'POST'])
-@limiter.limit("5 per minute", key_func=lambda: request.remote_addr)
-@limiter.limit("10 per hour", key_func=lambda: getattr(current_user, 'id', request.remote_addr))
+@limiter.limit("5 per minute", key_func=_client_ip)
+@limiter.limit("10 per hour", key_func=_user_or_ip)
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(username=form.username.data).first()
+        pwd = form.password.data
         
-        # Check if this is an old SHA-256 password hash (exactly 64 characters)
-        # SHA-256 hashes are 64 characters long, bcrypt hashes start with $2b$
-        if user and user.password_hash and len(user.password_hash) == 64 and not user.password_hash.startswith('$2b$'):
-            import hashlib
-            # Verify with old method
-            sha2_hash = hashlib.sha256(form.password.data.encode()).hexdigest()
-            if sha2_hash == user.password_hash:
+        # Bcrypt hashes start with $2b$ and are by far the common case, so check
+        # them first. Old SHA-256 password hashes are exactly 64 characters long.
+        password_hash = user.password_hash if user else None
+        if password_hash and password_hash.startswith('$2b$'):
+            if not user.check_password(pwd):
+                flash('Invalid username or password')
+                return redirect(url_for('login'))
+        elif password_hash and len(password_hash) == 64:
+            # Verify with old method (constant-time comparison)
+            pwd_bytes = pwd.encode('utf-8')
+            sha2_hash = hashlib.sha256(pwd_bytes).hexdigest()
+            if hmac.compare_digest(sha2_hash, password_hash):
                 # Upgrade to bcrypt
-                user.set_password(form.password.data)
+                user.set_password(pwd)
                 db.session.commit()
                 # Continue with login
             else:
                 flash('Invalid username or password')
                 return redirect(url_for('login'))
-        elif user is None or not user.check_password(form.password.data):
+        elif user is None or not user.check_password(pwd):
             flash('Invalid username or password')
             return redirect(url_for('login'))
         
@@ -144,8 +322,8 @@ def logout():
 
 # Registration: 3 per hour per IP
 @app.route('/register', methods=['GET', 'POST'])
-@limiter.limit("3 per minute", key_func=lambda: request.remote_addr)
-@limiter.limit("5 per hour", key_func=lambda: request.form.get('username', request.remote_addr))
+@limiter.limit("3 per minute", key_func=_client_ip)
+@limiter.limit("5 per hour", key_func=_form_field_or_ip('username'))
 def register():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -164,26 +342,26 @@ def register():
 
 @app.route('/account/pin', methods=['GET', 'POST'])
 @login_required
+@limiter.limit("10 per hour", key_func=_user_or_ip, methods=['POST'])
 def account_pin():
     if not current_user.pin_hash:
         return redirect(url_for('create_pin'))
     form = PinForm()
-    # Track failed attempts in session
-    if 'pin_attempts' not in session:
-        session['pin_attempts'] = 0
-    show_reset = False
+    # Failed attempts are counted on the user record, not in the session
+    show_reset = current_user.pin_locked
     if form.validate_on_submit():
-        if current_user.check_pin(form.pin.data):
+        verified = current_user.check_pin(form.pin.data)
+        db.session.commit()  # Persist the attempt count and any PIN hash upgrade
+        if verified:
             session['pin_verified'] = True
-            session['pin_attempts'] = 0  # Reset on success
             return redirect(url_for('account'))
+        if current_user.pin_locked:
+            show_reset = True
+            flash('You have entered an incorrect PIN three times. Please reset your PIN.')
         else:
-            session['pin_attempts'] += 1
-            if session['pin_attempts'] >= 3:
-                show_reset = True
-                flash('You have entered an incorrect PIN three times. Please reset your PIN.')
-            else:
-                flash('Incorrect PIN. Please try again.')
+            flash('Incorrect PIN. Please try again.')
+    elif show_reset:
+        flash('Your PIN is locked after too many incorrect attempts. Please reset your PIN.')
     return render_template('pin_verify.html', form=form, title='Enter PIN', show_reset=show_reset)
 
 @app.route('/account/create_pin', methods=['GET', 'POST'])
@@ -200,28 +378,10 @@ def create_pin():
         return redirect(url_for('account'))
     return render_template('pin_create.html', form=form, title='Create PIN')
 
+@app.route('/reset_pin', methods=['GET', 'POST'])
 @app.route('/account/reset_pin', methods=['GET', 'POST'])
 @login_required
 def reset_pin():
-    from forms import ResetPinForm
-    form = ResetPinForm()
-    if form.validate_on_submit():
-        user = current_user
-        # Confirm password
-        if not user.check_password(form.password.data):
-            form.password.errors.append('Incorrect password.')
-            return render_template('pin_reset.html', form=form)
-        # Set new PIN
-        user.set_pin(form.pin.data)
-        db.session.commit()
-        flash('Your PIN has been reset successfully.')
-        return redirect(url_for('account'))
-    return render_template('pin_reset.html', form=form)
-
-@app.route('/reset_pin', methods=['GET', 'POST'])
-@login_required
-def reset_pin_global():
-    from forms import ResetPinForm
     form = ResetPinForm()
     if form.validate_on_submit():
         user = current_user
@@ -240,10 +400,8 @@ def reset_pin_global():
 @app.route('/account')
 @login_required
 def account():
-    if current_user.status != 'active' and not current_user.is_admin and not current_user.is_manager:
-        flash('Your account is awaiting approval from an administrator.')
-        logout_user()
-        return redirect(url_for('login'))
+    if (response := _ensure_active(log_out=True)):
+        return response
     if not current_user.pin_hash:
         return redirect(url_for('create_pin'))
     if not session.get('pin_verified'):
@@ -254,12 +412,11 @@ def account():
 # Transfer: 10 per hour per user
 @app.route('/transfer', methods=['GET', 'POST'])
 @login_required
-@limiter.limit("10 per hour", key_func=lambda: current_user.get_id() or get_remote_address())
-@limiter.limit("20 per hour", key_func=lambda: request.remote_addr)
+@limiter.limit("10 per hour", key_func=_user_or_ip)
+@limiter.limit("20 per hour", key_func=_client_ip)
 def transfer():
-    if current_user.status != 'active' and not current_user.is_admin and not current_user.is_manager:
-        flash('Your account is awaiting approval from an administrator.')
-        return redirect(url_for('index'))
+    if (response := _ensure_active()):
+        return response
         
     form = TransferForm()
     if form.validate_on_submit():
@@ -305,12 +462,11 @@ def transfer():
 # Execute transfer: 10 per hour per user
 @app.route('/execute_transfer', methods=['POST'])
 @login_required
-@limiter.limit("10 per hour", key_func=lambda: current_user.get_id() or get_remote_address())
-@limiter.limit("20 per hour", key_func=lambda: request.remote_addr)
+@limiter.limit("10 per hour", key_func=_user_or_ip)
+@limiter.limit("20 per hour", key_func=_client_ip)
 def execute_transfer():
-    if current_user.status != 'active' and not current_user.is_admin and not current_user.is_manager:
-        flash('Your account is awaiting approval from an administrator.')
-        return redirect(url_for('index'))
+    if (response := _ensure_active()):
+        return response
     
     form = ConfirmTransferForm()
     if form.validate_on_submit():
@@ -344,8 +500,8 @@ def execute_transfer():
 
 # Password reset request: 3 per hour per IP
 @app.route('/reset_password_request', methods=['GET', 'POST'])
-@limiter.limit("2 per minute", key_func=lambda: request.remote_addr)
-@limiter.limit("5 per hour", key_func=lambda: request.form.get('email', request.remote_addr))
+@limiter.limit("2 per minute", key_func=_client_ip)
+@limiter.limit("5 per hour", key_func=_form_field_or_ip('email'))
 def reset_password_request():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -360,20 +516,19 @@ def reset_password_request():
 
 # Password reset: 3 per hour per IP
 @app.route('/reset_password/<token>', methods=['GET', 'POST'])
-@limiter.limit("5 per hour", key_func=lambda: request.remote_addr)
+@limiter.limit("5 per hour", key_func=_client_ip)
 def reset_password(token):
     if current_user.is_authenticated:
         return redirect(url_for('index'))
     try:
-        serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'])
-        email = serializer.loads(token, salt='password-reset', max_age=3600)
+        email = reset_serializer.loads(token, salt='password-reset', max_age=3600)
         user = User.query.filter_by(email=email).first()
         if not user:
             return redirect(url_for('index'))
     except SignatureExpired:
         flash('The password reset link has expired.')
         return redirect(url_for('reset_password_request'))
-    except:
+    except BadSignature:
         flash('Invalid reset link')
         return redirect(url_for('reset_password_request'))
     form = ResetPasswordForm()
@@ -393,15 +548,17 @@ def reset_password(token):
 @admin_required
 @limiter.limit("60 per hour")
 def admin_dashboard():
+    page = request.args.get('page', 1, type=int)
     # Regular admins can only see regular users
     if current_user.is_manager:
         # Managers can see all regular users
-        users = User.query.filter(User.is_admin.is_(False)).all()
+        query = User.query.filter(User.is_admin.is_(False))
     else:
         # Regular admins can only see regular users (not managers or other admins)
-        users = User.query.filter(User.is_admin.is_(False), User.is_manager.is_(False)).all()
+        query = User.query.filter(User.is_admin.is_(False), User.is_manager.is_(False))
+    pagination = query.order_by(User.id).paginate(page=page, per_page=50, error_out=False)
     
-    return render_template('admin/dashboard.html', title='Admin Dashboard', users=users)
+    return render_template('admin/dashboard.html', title='Admin Dashboard', users=pagination.items, pagination=pagination)
 
 @app.route('/admin/activate_user/<int:user_id>')
 @login_required
@@ -491,8 +648,6 @@ def admin_deposit():
 @login_required
 @admin_required
 def edit_user(user_id):
-    from forms import UserEditForm  # Import here to avoid circular imports
-    
     user = User.query.get_or_404(user_id)
     
     # Ensure admin can only edit users they can manage
@@ -535,19 +690,12 @@ def edit_user(user_id):
         
         # If we have a province, load cities/municipalities
         if province_code:
-            cities = psgc_api.get_cities(province_code)
-            municipalities = psgc_api.get_municipalities(province_code)
-            city_choices = [('', '-- Select City/Municipality --')]
-            
-            # Add cities
-            for city in cities:
-                city_choices.append((city['code'], f"{city['name']} (City)"))
-            
-            # Add municipalities
-            for municipality in municipalities:
-                city_choices.append((municipality['code'], municipality['name']))
-            
-            form.city_name.choices = city_choices
+            cities, municipalities = psgc_api.get_cities_and_municipalities(province_code)
+            form.city_name.choices = (
+                [('', '-- Select City/Municipality --')]
+                + [(city['code'], f"{city['name']} (City)") for city in cities]
+                + [(municipality['code'], municipality['name']) for municipality in municipalities]
+            )
             
             # Load existing city selection
             city_code = user.city_code
@@ -556,14 +704,7 @@ def edit_user(user_id):
             
             # If we have a city, load barangays
             if city_code:
-                barangays = []
-                # Check if it's a city or municipality
-                city_info = psgc_api.get_city_by_code(city_code)
-                if city_info:
-                    barangays = psgc_api.get_barangays(city_code=city_code)
-                else:
-                    barangays = psgc_api.get_barangays(municipality_code=city_code)
-                
+                barangays = psgc_api.get_barangays_for_locality(city_code)
                 form.barangay_name.choices = [('', '-- Select Barangay --')] + [(b['code'], b['name']) for b in barangays]
     else:
         # If no region selected, provide empty choices for dependent fields
@@ -605,25 +746,28 @@ def edit_user(user_id):
         if user.status != form.status.data:
             changes.append(f"Status: {user.status} → {form.status.data}")
             
+        # Resolve the selected address codes once; used for both the audit
+        # record and the update below
+        region = psgc_api.get_region_by_code(form.region_name.data) if form.region_name.data else None
+        province = psgc_api.get_province_by_code(form.province_name.data) if form.province_name.data else None
+        city, municipality = psgc_api.get_city_or_municipality_by_code(form.city_name.data) if form.city_name.data else (None, None)
+        locality = city or municipality
+        barangay = psgc_api.get_barangay_by_code(form.barangay_name.data) if form.barangay_name.data else None
+        
         # Address fields changes
-        if form.region_name.data and form.region_name.data != '' and form.region_name.data != user.region_code:
-            region = psgc_api.get_region_by_code(form.region_name.data)
+        if form.region_name.data and form.region_name.data != user.region_code:
             region_name = region['name'] if region else form.region_name.data
             changes.append(f"Region: {user.region_name or 'None'} → {region_name}")
             
-        if form.province_name.data and form.province_name.data != '' and form.province_name.data != user.province_code:
-            province = psgc_api.get_province_by_code(form.province_name.data)
+        if form.province_name.data and form.province_name.data != user.province_code:
             province_name = province['name'] if province else form.province_name.data
             changes.append(f"Province: {user.province_name or 'None'} → {province_name}")
             
-        if form.city_name.data and form.city_name.data != '' and form.city_name.data != user.city_code:
-            city = psgc_api.get_city_by_code(form.city_name.data)
-            municipality = None if city else psgc_api.get_municipality_by_code(form.city_name.data)
-            city_name = city['name'] if city else (municipality['name'] if municipality else form.city_name.data)
+        if form.city_name.data and form.city_name.data != user.city_code:
+            city_name = locality['name'] if locality else form.city_name.data
             changes.append(f"City/Municipality: {user.city_name or 'None'} → {city_name}")
             
-        if form.barangay_name.data and form.barangay_name.data != '' and form.barangay_name.data != user.barangay_code:
-            barangay = psgc_api.get_barangay_by_code(form.barangay_name.data)
+        if form.barangay_name.data and form.barangay_name.data != user.barangay_code:
             barangay_name = barangay['name'] if barangay else form.barangay_name.data
             changes.append(f"Barangay: {user.barangay_name or 'None'} → {barangay_name}")
             
@@ -640,42 +784,32 @@ def edit_user(user_id):
         user.status = form.status.data
         
         # Update address data with names and codes
-        if form.region_name.data and form.region_name.data != '':
+        if form.region_name.data:
             user.region_code = form.region_name.data
-            region = psgc_api.get_region_by_code(form.region_name.data)
             if region:
                 user.region_name = region['name']
         else:
             user.region_code = None
             user.region_name = None
             
-        if form.province_name.data and form.province_name.data != '':
+        if form.province_name.data:
             user.province_code = form.province_name.data
-            province = psgc_api.get_province_by_code(form.province_name.data)
             if province:
                 user.province_name = province['name']
         else:
             user.province_code = None
             user.province_name = None
             
-        if form.city_name.data and form.city_name.data != '':
+        if form.city_name.data:
             user.city_code = form.city_name.data
-            # Check if it's a city
-            city = psgc_api.get_city_by_code(form.city_name.data)
-            if city:
-                user.city_name = city['name']
-            else:
-                # Must be a municipality
-                municipality = psgc_api.get_municipality_by_code(form.city_name.data)
-                if municipality:
-                    user.city_name = municipality['name']
+            if locality:
+                user.city_name = locality['name']
         else:
             user.city_code = None
             user.city_name = None
             
-        if form.barangay_name.data and form.barangay_name.data != '':
+        if form.barangay_name.data:
             user.barangay_code = form.barangay_name.data
-            barangay = psgc_api.get_barangay_by_code(form.barangay_name.data)
             if barangay:
                 user.barangay_name = barangay['name']
         else:
@@ -684,18 +818,9 @@ def edit_user(user_id):
         
         # Create audit record if there were changes
         if changes:
-            # Create a transaction record for the user edit
-            transaction = Transaction(
-                sender_id=current_user.id,  # Admin making the change
-                receiver_id=user.id,        # User being modified
-                amount=None,                # No money involved
-                transaction_type='user_edit',
-                details="\n".join(changes),
-                timestamp=datetime.datetime.utcnow()
-            )
-            db.session.add(transaction)
+            record_audit(current_user.id, user.id, changes)
         
-        db.session.commit()
+        commit_with_audits()
         flash(f'User information for {user.username} has been updated.')
         return redirect(url_for('admin_dashboard'))
     
@@ -706,72 +831,86 @@ def edit_user(user_id):
 @admin_required
 def admin_user_transactions(user_id):
     user = User.query.get_or_404(user_id)
-    transactions = Transaction.query.filter(
+    transactions, next_url, newest_url = paginate_transactions(Transaction.query.options(
+        selectinload(Transaction.sender),
+        selectinload(Transaction.receiver)
+    ).filter(
         (Transaction.sender_id == user.id) | (Transaction.receiver_id == user.id)
-    ).order_by(Transaction.timestamp.desc()).all()
-    return render_template('admin/user_transactions.html', user=user, transactions=transactions)
+    ))
+    return render_template('admin/user_transactions.html', user=user, transactions=transactions,
+                           next_url=next_url, newest_url=newest_url)
 
+# --- CSV Export and Bulk Data Guidelines ---
+# 1. Exports run every query (including the streamed rows) in the request's single
+#    database transaction. Under InnoDB's REPEATABLE READ isolation that transaction
+#    reads from one consistent snapshot, so never commit inside an export.
+# 2. Exports are read-only; stream rows with yield_per() instead of loading them all.
+# 3. Any future bulk import/update must not commit per row. Add rows in chunks of
+#    about 1000 (db.session.bulk_save_objects(chunk)) and commit once per chunk.
+# 4. Exports are streamed so the first bytes go out right away and a slow export
+#    can't hit the proxy's read timeout; X-Accel-Buffering stops nginx-style proxies
+#    from buffering the whole file first. If exports outgrow a request, move them to
+#    a background job that writes the file and returns a download link.
 @app.route('/admin/user/<int:user_id>/export_transactions')
 @login_required
 @admin_required
 def admin_export_user_transactions(user_id):
-    import csv
-    from io import StringIO
     user = User.query.get_or_404(user_id)
-    transactions = Transaction.query.filter(
-        (Transaction.sender_id == user.id) | (Transaction.receiver_id == user.id)
-    ).order_by(Transaction.timestamp.desc()).all()
-    si = StringIO()
-    writer = csv.writer(si)
-    writer.writerow(['Account Number', 'Username', 'Remaining Balance', 'Transaction ID', 'Type', 'Amount', 'Sender', 'Receiver', 'Timestamp', 'Details'])
-    for t in transactions:
-        sender = t.sender_id and User.query.get(t.sender_id).username or 'N/A'
-        receiver = t.receiver_id and User.query.get(t.receiver_id).username or 'N/A'
-        amount_str = f"₱{t.amount:.2f}" if t.amount is not None else 'N/A'
-        writer.writerow([
-            user.account_number,
-            user.username,
-            f"₱{user.balance:.2f}",
-            t.id,
-            t.transaction_type,
-            amount_str,
-            sender,
-            receiver,
-            t.timestamp.strftime('%Y-%m-%d %H:%M'),
-            t.details or ''
-        ])
-    output = si.getvalue()
-    si.close()
-    return (output, 200, {
-        'Content-Type': 'text/csv',
-        'Content-Disposition': f'attachment; filename={user.username}_transactions.csv'
+    user_filter = (Transaction.sender_id == user.id) | (Transaction.receiver_id == user.id)
+    transactions = Transaction.query.filter(user_filter).order_by(Transaction.timestamp.desc())
+    # Look up all counterparty usernames in one query instead of two per row
+    name_map = dict(db.session.query(User.id, User.username).filter(db.or_(
+        User.id.in_(db.session.query(Transaction.sender_id).filter(user_filter)),
+        User.id.in_(db.session.query(Transaction.receiver_id).filter(user_filter))
+    )).all())
+    account_number, username, balance = user.account_number, user.username, format_peso(user.balance)
+    
+    def rows():
+        for t in transactions.yield_per(CSV_BATCH_SIZE):
+            yield (
+                account_number,
+                username,
+                balance,
+                t.id,
+                t.transaction_type,
+                format_peso(t.amount),
+                name_map.get(t.sender_id, 'N/A'),
+                name_map.get(t.receiver_id, 'N/A'),
+                t.timestamp.strftime('%Y-%m-%d %H:%M'),
+                t.details or ''
+            )
+    
+    header = ['Account Number', 'Username', 'Remaining Balance', 'Transaction ID', 'Type', 'Amount', 'Sender', 'Receiver', 'Timestamp', 'Details']
+    return Response(stream_with_context(stream_csv(header, rows())), mimetype='text/csv', headers={
+        'Content-Disposition': f'attachment; filename={username}_transactions.csv',
+        'X-Accel-Buffering': 'no'
     })
 
 @app.route('/admin/export_users')
 @login_required
 @admin_required
 def export_users():
-    import csv
-    from io import StringIO
-    users = User.query.all()
-    si = StringIO()
-    writer = csv.writer(si)
-    writer.writerow(['Username', 'Email', 'Account Number', 'Role', 'Status', 'Balance', 'Date Registered'])
-    for user in users:
-        writer.writerow([
-            user.username,
-            user.email,
-            user.account_number,
-            'Admin' if user.is_admin else 'Manager' if user.is_manager else 'User',
-            user.status.title(),
-            f"₱{user.balance:.2f}" if user.balance is not None else 'N/A',
-            user.date_registered.strftime('%Y-%m-%d %H:%M')
-        ])
-    output = si.getvalue()
-    si.close()
-    return (output, 200, {
-        'Content-Type': 'text/csv',
-        'Content-Disposition': 'attachment; filename=users_export.csv'
+    def rows():
+        # Select only the exported columns; the role label is computed in SQL
+        query = db.session.query(
+            User.username, User.email, User.account_number, User.role,
+            User.status, User.balance, User.date_registered
+        ).order_by(User.id)
+        for username, email, account_number, role, status, balance, date_registered in query.yield_per(CSV_BATCH_SIZE):
+            yield (
+                username,
+                email,
+                account_number,
+                role,
+                status.title(),
+                format_peso(balance),
+                date_registered.strftime('%Y-%m-%d %H:%M')
+            )
+    
+    header = ['Username', 'Email', 'Account Number', 'Role', 'Status', 'Balance', 'Date Registered']
+    return Response(stream_with_context(stream_csv(header, rows())), mimetype='text/csv', headers={
+        'Content-Disposition': 'attachment; filename=users_export.csv',
+        'X-Accel-Buffering': 'no'
     })
 
 # Apply rate limiting to API endpoints
@@ -779,8 +918,9 @@ def export_users():
 @app.route('/api/provinces/<region_code>')
 @login_required
 @admin_required
-@limiter.limit("20 per minute", key_func=get_remote_address)
+@limiter.limit("20 per minute", key_func=_client_ip)
 def get_provinces(region_code):
+    # psgc_api caches the lookup, so the response is only reshaped here
     provinces = psgc_api.get_provinces(region_code)
     return jsonify([{'code': p['code'], 'name': p['name']} for p in provinces])
 
@@ -788,40 +928,23 @@ def get_provinces(region_code):
 @app.route('/api/cities/<province_code>')
 @login_required
 @admin_required
-@limiter.limit("20 per minute", key_func=get_remote_address)
+@limiter.limit("20 per minute", key_func=_client_ip)
 def get_cities_and_municipalities(province_code):
-    # Check if it's a city or municipality
-    cities = psgc_api.get_cities(province_code)
-    municipalities = psgc_api.get_municipalities(province_code)
-    
-    result = []
-    
-    # Add cities
-    for city in cities:
-        result.append({'code': city['code'], 'name': f"{city['name']} (City)"})
-    
-    # Add municipalities
-    for municipality in municipalities:
-        result.append({'code': municipality['code'], 'name': municipality['name']})
-        
-    return jsonify(result)
+    # psgc_api caches both lookups, so the response is only reshaped here
+    cities, municipalities = psgc_api.get_cities_and_municipalities(province_code)
+    return jsonify(
+        [{'code': city['code'], 'name': f"{city['name']} (City)"} for city in cities]
+        + [{'code': municipality['code'], 'name': municipality['name']} for municipality in municipalities]
+    )
 
 # Admin/manager API endpoints: 20 per minute per IP
 @app.route('/api/barangays/<city_code>')
 @login_required
 @admin_required
-@limiter.limit("20 per minute", key_func=get_remote_address)
+@limiter.limit("20 per minute", key_func=_client_ip)
 def get_barangays(city_code):
-    # Check if it's a city or municipality
-    city_info = psgc_api.get_city_by_code(city_code)
-    
-    barangays = []
-    if city_info:
-        barangays = psgc_api.get_barangays(city_code=city_code)
-    else:
-        # Must be a municipality
-        barangays = psgc_api.get_barangays(municipality_code=city_code)
-        
+    # psgc_api caches the lookup, so the response is only reshaped here
+    barangays = psgc_api.get_barangays_for_locality(city_code)
     return jsonify([{'code': b['code'], 'name': b['name']} for b in barangays])
 
 # Manager routes
@@ -830,11 +953,14 @@ def get_barangays(city_code):
 @manager_required
 @limiter.limit("60 per hour")
 def manager_dashboard():
-    # Managers can see all admins and regular users, but not other managers
-    admins = User.query.filter_by(is_admin=True, is_manager=False).all()
-    regular_users = User.query.filter_by(is_admin=False, is_manager=False).all()
+    # Managers can see all admins, but not other managers; the dashboard only
+    # lists admins, so load just them and just the columns it shows
+    admins = db.session.query(
+        User.id, User.username, User.email, User.account_number,
+        User.status, User.date_registered
+    ).filter(User.is_admin.is_(True), User.is_manager.is_(False)).all()
     
-    return render_template('manager/dashboard.html', title='Manager Dashboard', admins=admins, regular_users=regular_users)
+    return render_template('manager/dashboard.html', title='Manager Dashboard', admins=admins)
 
 @app.route('/manager/create_admin', methods=['GET', 'POST'])
 @login_required
@@ -847,6 +973,7 @@ def create_admin():
         admin.set_password(form.password.data)
         db.session.add(admin)
         db.session.commit()
+        clear_admin_cache()
         flash('Admin account has been created')
         return redirect(url_for('admin_list'))
     return render_template('manager/create_admin.html', title='Create Admin Account', form=form)
@@ -873,34 +1000,42 @@ def toggle_admin(user_id):
         user.status = 'active'  # Set status to active when promoting to admin
         flash(f'User {user.username} has been promoted to admin.')
         db.session.commit()
+        clear_admin_cache()
         return redirect(url_for('user_list'))
     else:
         flash(f'User {user.username} has been demoted from admin.')
         db.session.commit()
+        clear_admin_cache()
         return redirect(url_for('admin_list'))
 
 @app.route('/manager/user_list')
 @login_required
 @manager_required
 def user_list():
-    # Get all users except admins and managers
-    users = User.query.filter(User.is_admin.is_(False), User.is_manager.is_(False)).all()
+    # Get all users except admins and managers, loading only the columns shown
+    users = db.session.query(
+        User.username, User.email, User.account_number, User.is_admin,
+        User.status, User.balance, User.date_registered
+    ).filter(User.is_admin.is_(False), User.is_manager.is_(False)).all()
     return render_template('manager/user_list.html', title='All Users', users=users)
 
 @app.route('/manager/admin_list')
 @login_required
 @manager_required
 def admin_list():
-    # Get all admin users except managers
-    admins = User.query.filter(User.is_admin.is_(True), User.is_manager.is_(False)).all()
+    # Get all admin users except managers, loading only the columns shown
+    admins = db.session.query(
+        User.id, User.username, User.email, User.account_number,
+        User.status, User.balance, User.date_registered
+    ).filter(User.is_admin.is_(True), User.is_manager.is_(False)).all()
     return render_template('manager/admin_list.html', title='All Admin Users', admins=admins)
 
 @app.route('/manager/admin_transactions')
 @login_required
 @manager_required
 def admin_transactions():
-    # Get all admin users except managers
-    admins = User.query.filter(User.is_admin.is_(True), User.is_manager.is_(False)).all()
+    # Get all admin users except managers (cached, see get_admins)
+    admins = get_admins()
     
     # Get all transactions where any admin is either a sender or receiver
     admin_ids = [admin.id for admin in admins]
@@ -913,44 +1048,26 @@ def admin_transactions():
         )
     )
     
-    # Apply search if provided
+    # Apply search if provided, as a single OR across all searchable fields
     search_term = request.args.get('search', '').strip()
     if search_term:
-        # Build list of transaction IDs that match search criteria
-        matching_transaction_ids = []
-        
+        sender = aliased(User)
+        receiver = aliased(User)
+        pattern = f'%{search_term}%'
+        conditions = [
+            sender.username.ilike(pattern),
+            receiver.username.ilike(pattern),
+            Transaction.details.ilike(pattern)
+        ]
         # If search term is a number, check transaction ID
-        if search_term.isdigit():
-            matching_transaction_ids.extend([t.id for t in Transaction.query.filter(Transaction.id == int(search_term)).all()])
-        
-        # Search by sender username
-        sender_matches = Transaction.query.join(
-            User, Transaction.sender_id == User.id
-        ).filter(
-            User.username.ilike(f'%{search_term}%')
-        ).all()
-        matching_transaction_ids.extend([t.id for t in sender_matches])
-        
-        # Search by receiver username
-        receiver_matches = Transaction.query.join(
-            User, Transaction.receiver_id == User.id
-        ).filter(
-            User.username.ilike(f'%{search_term}%')
-        ).all()
-        matching_transaction_ids.extend([t.id for t in receiver_matches])
-        
-        # Search in transaction details
-        detail_matches = Transaction.query.filter(
-            Transaction.details.ilike(f'%{search_term}%')
-        ).all()
-        matching_transaction_ids.extend([t.id for t in detail_matches])
-        
-        # Filter original query to only include matching transactions
-        if matching_transaction_ids:
-            query = query.filter(Transaction.id.in_(set(matching_transaction_ids)))
-        else:
-            # If no matches, return empty result
-            query = query.filter(Transaction.id == -1)  # Impossible condition to return empty set
+        as_int, _ = parse_search_number(search_term)
+        if as_int is not None:
+            conditions.append(Transaction.id == as_int)
+        query = query.outerjoin(
+            sender, Transaction.sender_id == sender.id
+        ).outerjoin(
+            receiver, Transaction.receiver_id == receiver.id
+        ).filter(db.or_(*conditions))
     
     # Apply filters
     transaction_type = request.args.get('type')
@@ -975,11 +1092,16 @@ def admin_transactions():
         )
     
     # Get sorted results
-    transactions = query.order_by(Transaction.timestamp.desc()).all()
+    transactions, next_url, newest_url = paginate_transactions(query.options(
+        selectinload(Transaction.sender),
+        selectinload(Transaction.receiver)
+    ))
     
     return render_template('manager/admin_transactions.html', 
                          title='Admin Transactions', 
                          transactions=transactions,
+                         next_url=next_url,
+                         newest_url=newest_url,
                          admins=admins)
 
 @app.route('/manager/transfers')
@@ -989,62 +1111,29 @@ def manager_transfers():
     # Base query - only get transfer transactions
     query = Transaction.query.filter(Transaction.transaction_type == 'transfer')
     
-    # Apply search if provided
+    # Apply search if provided, as a single OR across all searchable fields
     search_term = request.args.get('search', '').strip()
     if search_term:
-        # Build list of transaction IDs that match search criteria
-        matching_transaction_ids = []
-        
-        # If search term is a number, check transaction ID
-        if search_term.isdigit():
-            matching_transaction_ids.extend([t.id for t in Transaction.query.filter(Transaction.id == int(search_term)).all()])
-        
-        # Search by sender username
-        sender_matches = Transaction.query.join(
-            User, Transaction.sender_id == User.id
-        ).filter(
-            User.username.ilike(f'%{search_term}%')
-        ).all()
-        matching_transaction_ids.extend([t.id for t in sender_matches])
-        
-        # Search by receiver username
-        receiver_matches = Transaction.query.join(
-            User, Transaction.receiver_id == User.id
-        ).filter(
-            User.username.ilike(f'%{search_term}%')
-        ).all()
-        matching_transaction_ids.extend([t.id for t in receiver_matches])
-        
-        # Search by sender account number
-        sender_account_matches = Transaction.query.join(
-            User, Transaction.sender_id == User.id
-        ).filter(
-            User.account_number.ilike(f'%{search_term}%')
-        ).all()
-        matching_transaction_ids.extend([t.id for t in sender_account_matches])
-        
-        # Search by receiver account number
-        receiver_account_matches = Transaction.query.join(
-            User, Transaction.receiver_id == User.id
-        ).filter(
-            User.account_number.ilike(f'%{search_term}%')
-        ).all()
-        matching_transaction_ids.extend([t.id for t in receiver_account_matches])
-        
-        # Search by amount (if search term can be converted to float)
-        try:
-            amount = float(search_term)
-            amount_matches = Transaction.query.filter(Transaction.amount == amount).all()
-            matching_transaction_ids.extend([t.id for t in amount_matches])
-        except ValueError:
-            pass
-            
-        # Filter original query to only include matching transactions
-        if matching_transaction_ids:
-            query = query.filter(Transaction.id.in_(set(matching_transaction_ids)))
-        else:
-            # If no matches, return empty result
-            query = query.filter(Transaction.id == -1)  # Impossible condition to return empty set
+        sender = aliased(User)
+        receiver = aliased(User)
+        pattern = f'%{search_term}%'
+        conditions = [
+            sender.username.ilike(pattern),
+            receiver.username.ilike(pattern),
+            sender.account_number.ilike(pattern),
+            receiver.account_number.ilike(pattern)
+        ]
+        # If search term is a number, check transaction ID and amount
+        as_int, as_float = parse_search_number(search_term)
+        if as_int is not None:
+            conditions.append(Transaction.id == as_int)
+        if as_float is not None:
+            conditions.append(Transaction.amount == as_float)
+        query = query.outerjoin(
+            sender, Transaction.sender_id == sender.id
+        ).outerjoin(
+            receiver, Transaction.receiver_id == receiver.id
+        ).filter(db.or_(*conditions))
     
     # Apply date range filter if provided
     from_date = request.args.get('from_date')
@@ -1103,15 +1192,20 @@ def manager_transfers():
                 )
             )
     
-    # Get all users for filter dropdown
-    users = User.query.all()
+    # Get all users for filter dropdown, loading only the columns it shows
+    users = db.session.query(User.id, User.username, User.is_admin, User.is_manager).order_by(User.username).all()
     
     # Get sorted results
-    transactions = query.order_by(Transaction.timestamp.desc()).all()
+    transactions, next_url, newest_url = paginate_transactions(query.options(
+        selectinload(Transaction.sender),
+        selectinload(Transaction.receiver)
+    ))
     
     return render_template('manager/transfers.html', 
                          title='Transfer Transactions', 
                          transactions=transactions,
+                         next_url=next_url,
+                         newest_url=newest_url,
                          users=users)
 
 # --- Secure Data Storage Enhancements ---
@@ -1138,9 +1232,14 @@ def mask_sensitive(value):
 
 @app.before_request
 def enforce_https():
-    if not app.debug and request.headers.get('X-Forwarded-Proto', 'http') != 'https':
-        url = request.url.replace('http://', 'https://', 1)
-        return redirect(url, code=301)
+    # Runs on every request: check the cheap conditions first and read the
+    # forwarded header straight from the WSGI environ
+    if app.debug or request.environ.get('HTTP_X_FORWARDED_PROTO') == 'https':
+        return None
+    url = request.url
+    if url.startswith('http://'):
+        url = 'https://' + url[len('http://'):]
+    return redirect(url, code=301)
 
 # --- Secure Transaction Logging (for auditing) ---
 # All transactions are already stored in the Transaction model with sender, receiver, amount, type, and timestamp.
@@ -29,6 +29,7 @@ CREATE TABLE user (
   phone VARCHAR(20),
   password_hash VARCHAR(128) NOT NULL,
   pin_hash VARCHAR(128), -- Added for PIN verification
+  pin_failed_attempts INT NOT NULL DEFAULT 0, -- Consecutive wrong PIN entries
   account_number VARCHAR(10) NOT NULL UNIQUE,
   balance FLOAT DEFAULT 1000.0,
   status VARCHAR(20) DEFAULT 'pending',
@@ -37,7 +38,8 @@ CREATE TABLE user (
   date_registered DATETIME DEFAULT CURRENT_TIMESTAMP,
   INDEX idx_username (username),
   INDEX idx_email (email),
-  INDEX idx_account_number (account_number)
+  INDEX idx_account_number (account_number),
+  INDEX idx_admin_mgr_status (is_admin, is_manager, status)
 ) ENGINE=InnoDB;
 
 -- Transactions table
@@ -51,7 +53,8 @@ CREATE TABLE transaction (
   details TEXT,
   FOREIGN KEY (sender_id) REFERENCES user (id),
   FOREIGN KEY (receiver_id) REFERENCES user (id),
-  INDEX idx_sender (sender_id),
-  INDEX idx_receiver (receiver_id),
-  INDEX idx_timestamp (timestamp)
+  INDEX idx_timestamp (timestamp),
+  INDEX idx_sender_timestamp (sender_id, timestamp),
+  INDEX idx_receiver_timestamp (receiver_id, timestamp),
+  INDEX idx_type_timestamp (transaction_type, timestamp)
 ) ENGINE=InnoDB; 
\ No newline at end of file